@@ -1,8 +1,14 @@
 import streamlit as st
 import pandas as pd
-from datetime import date, timedelta
-import plotly.express as px
+import numpy as np
+import time
+from datetime import date
+from functools import lru_cache
 import plotly.graph_objects as go
+import plotly.io as pio
+
+# Serialize figures with orjson; st.plotly_chart re-encodes every chart on every rerun
+pio.json.config.default_engine = "orjson"
 
 # --- 1. Configuration & Connection Setup ---
 # Replace 'your-project-id' with your actual Google Cloud Project ID
@@ -10,6 +16,9 @@ PROJECT_ID = "habittracker-streamlit-project"
 DATASET_NAME = "habit_tracker_db"
 TABLE_NAME = "TrackingLog"
 
+# How long (seconds) query results are reused before BigQuery is hit again
+REFRESH_SECONDS = 60
+
 # Define the full table reference for SQL queries
 FULL_TABLE_REF = f"`{PROJECT_ID}.{DATASET_NAME}.{TABLE_NAME}`"
 
@@ -18,71 +27,165 @@ conn = st.connection("sql")
 
 # Column names must match your BigQuery/Google Sheet exactly
 REQUIRED_COLUMNS = ["Date", "Habit", "Status", "Is_Active", "Daily_Reflection", "Mood"]
+# Daily_Reflection isn't shown on the dashboard, so it is never pulled from BigQuery
+LOADED_COLUMNS = [col for col in REQUIRED_COLUMNS if col != "Daily_Reflection"]
+TRUTHY_VALUES = ('true', '1', 'yes')
 
 # Badge & Mood Definitions
 BADGE_TIERS = {1: "🌟 New Start", 7: "🏆 Bronze Star", 30: "🥈 Silver Champion", 90: "🥇 Gold Titan"}
+SORTED_BADGE_TIERS = sorted(BADGE_TIERS.items(), reverse=True)
 MOOD_OPTIONS_MAP = {1: "☺️ Happy", 2: "😑 Meh", 3: "😞 Disappointed", 4: "😭 Crying", 5: "🥰 Loved", 
                     6: "👼 Peaceful", 7: "🥳 Excited", 8: "🤩 Amazed", 9: "🥱 Tired", 10: "🤧 Sick"}
 UNSELECTED_MOOD_KEY = 0
 UNSELECTED_MOOD_LABEL = "--- Select Your Mood ---"
+# Mood value -> label lookup for chart hovers; out-of-range values clip to a blank label at either end
+MOOD_LABELS = np.array([""] + [MOOD_OPTIONS_MAP[k] for k in sorted(MOOD_OPTIONS_MAP)] + [""])
+
+# Heatmap grid axes: one row per Mon-Sun week, covering the last HEATMAP_WEEKS weeks up to today
+DAY_ORDER = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+HEATMAP_WEEKS = 53
+
+# Above this many mood entries the chart is downsampled (LTTB) before plotting
+MOOD_CHART_MAX_POINTS = 1500
 
 # --- 2. Data Loading ---
-@st.cache_data(ttl=60) # Refreshes every minute
+def optimize_dataframe(df):
+    # Data Cleaning: Convert BigQuery types to narrow Python-friendly types
+    # Parse dates once here so nothing downstream has to copy a slice just to convert them
+    df["Date"] = pd.to_datetime(df["Date"], errors='coerce')
+    df["Habit"] = df["Habit"].astype("category")
+    df['Mood'] = pd.to_numeric(df['Mood'], errors='coerce').fillna(UNSELECTED_MOOD_KEY).astype("int8")
+    
+    # Convert Status and Is_Active to true booleans (vectorized, no per-row lambda)
+    df['Status'] = df['Status'].astype(str).str.lower().isin(TRUTHY_VALUES)
+    df['Is_Active'] = df['Is_Active'].astype(str).str.lower().isin(TRUTHY_VALUES)
+    
+    return df.dropna(subset=["Date"])
+
+@st.cache_data(ttl=REFRESH_SECONDS, show_spinner=False)
 def load_data():
     try:
-        # SQL Query to pull data from the BigQuery linked table
-        query = f"SELECT * FROM {FULL_TABLE_REF}"
-        df = conn.query(query)
-        
-        # Data Cleaning: Convert BigQuery types to Python-friendly types
-        df["Date"] = df["Date"].astype(str)
-        df['Mood'] = pd.to_numeric(df['Mood'], errors='coerce').fillna(UNSELECTED_MOOD_KEY).astype(int)
-        
-        # Convert Status and Is_Active to true booleans
-        df['Status'] = df['Status'].apply(lambda x: str(x).lower() in ('true', '1', 'yes'))
-        df['Is_Active'] = df['Is_Active'].apply(lambda x: str(x).lower() in ('true', '1', 'yes'))
-        
+        # SQL Query to pull only the columns we use from the BigQuery linked table
+        query = f"SELECT {', '.join(LOADED_COLUMNS)} FROM {FULL_TABLE_REF}"
+        # conn.query caches forever by default, so keep it in step with our ttl
+        df = conn.query(query, ttl=REFRESH_SECONDS)
+        df = optimize_dataframe(df)
+        # Stamped only on a real reload (cache hits return the same value), so it works as an O(1) cache key
+        df.attrs["rev"] = time.time_ns()
         return df
     except Exception as e:
         st.error(f"⚠️ Connection Error: {e}")
-        return pd.DataFrame(columns=REQUIRED_COLUMNS)
+        return pd.DataFrame(columns=LOADED_COLUMNS)
 
 # --- 3. Helper Functions ---
-def calculate_streak(df, habit_name):
-    completed_dates = df[(df["Habit"] == habit_name) & (df["Status"] == True)]["Date"].unique()
-    if len(completed_dates) == 0: return 0
-    streak, check_date = 0, date.today()
-    if str(check_date) not in completed_dates:
-        check_date -= timedelta(days=1)
-    while str(check_date) in completed_dates:
-        streak += 1
-        check_date -= timedelta(days=1)
-    return streak
+def get_completed_days(df):
+    # One pass over the log: habit -> sorted unique completion days (int days since epoch)
+    completed = df.loc[df["Status"], ["Habit", "Date"]]
+    return {habit: np.unique(dates.values.astype("datetime64[D]").astype(np.int64))
+            for habit, dates in completed.groupby("Habit", observed=True)["Date"]}
+
+def calculate_streak(completed_days):
+    if len(completed_days) == 0: return 0
+    today = np.datetime64(date.today(), "D").astype(np.int64)
+    # Everything up to and including today; future-dated entries don't count
+    end = np.searchsorted(completed_days, today, side="right")
+    # The streak may end today or, if today isn't logged yet, yesterday
+    if end == 0 or completed_days[end - 1] < today - 1: return 0
+    gaps = np.flatnonzero(np.diff(completed_days[:end]) != 1)
+    return int(end - gaps[-1] - 1) if len(gaps) else int(end)
+
+def get_streak_index(df):
+    # Streaks only change when the data (or the day) does, so reuse them across reruns
+    fingerprint = (df.attrs.get("rev"), date.today())
+    if st.session_state.get("streak_fp") != fingerprint:
+        completed = get_completed_days(df)
+        st.session_state.completed_by_habit = completed
+        st.session_state.streak_cache = {habit: calculate_streak(days) for habit, days in completed.items()}
+        st.session_state.streak_fp = fingerprint
+    return st.session_state.completed_by_habit, st.session_state.streak_cache
 
+@lru_cache(maxsize=None)
 def get_badge(streak):
     if streak == 0: return "❄️ No Streak"
-    badge = ""
-    for threshold in sorted(BADGE_TIERS.keys(), reverse=True):
-        if streak >= threshold:
-            badge = BADGE_TIERS[threshold]
-            break
+    badge = next((label for threshold, label in SORTED_BADGE_TIERS if streak >= threshold), "")
     return f"{badge} ({streak} Days)"
 
 # --- 4. Visualizations (Plotly) ---
-def create_heatmap_plotly(df, habit_name):
-    heatmap_data = df[(df['Habit'] == habit_name) & (df['Status'] == True)].copy()
-    if heatmap_data.empty:
+# Figures are cached on the bytes of their (small) input arrays, so reruns with unchanged data reuse them
+@st.cache_resource(max_entries=32, show_spinner=False)
+def _build_heatmap_fig(habit_name, first_monday, z_bytes):
+    z = np.frombuffer(z_bytes, dtype=np.float32).reshape(HEATMAP_WEEKS, 7)
+    mondays = np.arange(first_monday, first_monday + HEATMAP_WEEKS * 7, 7).astype("datetime64[D]")
+    fig = go.Figure(data=go.Heatmap(
+        x=DAY_ORDER,
+        y=np.datetime_as_string(mondays),
+        z=z,
+        # Fixed 0/1 range so an all-zero grid isn't auto-scaled to mid-green
+        zmin=0, zmax=1,
+        colorscale='Greens', showscale=False, hoverongaps=False,
+        # Formatted client-side by Plotly from the axes and z instead of shipping a hover string per cell
+        hovertemplate="Week of %{y}, %{x}<br>Done: %{z}<extra></extra>"
+    ))
+    fig.update_layout(title=f"Consistency: {habit_name}", height=300, yaxis_title="Week of", yaxis_type="category")
+    return fig
+
+def create_heatmap_plotly(completed_days, habit_name):
+    today = np.datetime64(date.today(), "D").astype(np.int64)
+    # 1970-01-01 was a Thursday, so (day + 3) % 7 is the weekday with Monday = 0
+    this_monday = today - (today + 3) % 7
+    first_monday = this_monday - (HEATMAP_WEEKS - 1) * 7
+    days = completed_days[(completed_days >= first_monday) & (completed_days <= today)] if len(completed_days) else ()
+    if len(days) == 0:
         st.info("No data for heatmap yet.")
         return
-    heatmap_data['Date'] = pd.to_datetime(heatmap_data['Date'])
-    fig = go.Figure(data=go.Heatmap(
-        x=heatmap_data['Date'].dt.day_name().str[:3],
-        y=heatmap_data['Date'].dt.isocalendar().week,
-        z=[1]*len(heatmap_data),
-        colorscale='Greens', showscale=False
+    # Each cell is one calendar day (oldest week in the first row): 1 done, 0 not done, NaN (blank) after today
+    z = np.zeros(HEATMAP_WEEKS * 7, dtype=np.float32)
+    z[today - first_monday + 1:] = np.nan
+    z[days - first_monday] = 1
+    st.plotly_chart(_build_heatmap_fig(habit_name, int(first_monday), z.tobytes()), use_container_width=True)
+
+def _lttb(x, y, n_out):
+    # Largest-Triangle-Three-Buckets: indices of n_out points that keep the line's visual shape
+    n = len(x)
+    if n <= n_out or n_out < 3:
+        return np.arange(n)
+    # First and last points are always kept; the rest is split into n_out - 2 buckets
+    edges = np.append(np.linspace(1, n - 1, n_out - 1).astype(np.int64), n)
+    keep = np.empty(n_out, dtype=np.int64)
+    keep[0], keep[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi, next_hi = edges[i], edges[i + 1], edges[i + 2]
+        cx, cy = x[hi:next_hi].mean(), y[hi:next_hi].mean()
+        area = np.abs((x[a] - cx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (cy - y[a]))
+        a = lo + int(np.argmax(area))
+        keep[i + 1] = a
+    return keep
+
+@st.cache_resource(max_entries=32, show_spinner=False)
+def _build_mood_fig(date_bytes, mood_bytes):
+    dates = np.frombuffer(date_bytes, dtype="datetime64[D]")
+    moods = np.frombuffer(mood_bytes, dtype=np.int8)
+    # Long histories are downsampled so the browser only draws what is visible at screen width
+    keep = _lttb(dates.astype(np.int64).astype(float), moods.astype(float), MOOD_CHART_MAX_POINTS)
+    fig = go.Figure(go.Scattergl(
+        x=dates[keep], y=moods[keep], mode='lines+markers',
+        customdata=np.take(MOOD_LABELS, moods[keep], mode="clip"),
+        hovertemplate="%{x|%Y-%m-%d}<br>%{customdata}<extra></extra>"
     ))
-    fig.update_layout(title=f"Consistency: {habit_name}", height=300)
-    st.plotly_chart(fig, use_container_width=True)
+    fig.update_layout(title="Mood over Time", xaxis_title="Date", yaxis_title="Mood")
+    return fig
+
+def create_mood_chart(df):
+    # Mood is logged per day but repeated on every habit row for that day; plot it once per date.
+    # Rows arrive in no particular order, so reduce deterministically rather than keeping "the last" one
+    daily_mood = (df.loc[df['Mood'] != UNSELECTED_MOOD_KEY, ['Date', 'Mood']]
+                  .groupby('Date', sort=True)['Mood'].max())
+    if daily_mood.empty:
+        return
+    dates = daily_mood.index.to_numpy(dtype="datetime64[D]")
+    moods = daily_mood.to_numpy(dtype=np.int8)
+    st.plotly_chart(_build_mood_fig(dates.tobytes(), moods.tobytes()), use_container_width=True)
 
 # --- 5. App Layout ---
 st.set_page_config(page_title="Habit Tracker (BigQuery)", layout="wide")
@@ -99,11 +202,14 @@ else:
 
     # Daily Status View
     st.header("📅 Current Streaks")
-    active_habits = df[df['Is_Active'] == True]['Habit'].unique()
+    # Computed once per rerun and shared by the streak metrics and the heatmap selectbox
+    active_habits = df.loc[df['Is_Active'], 'Habit'].unique().tolist()
+    
+    completed_by_habit, streaks = get_streak_index(df)
     
     cols = st.columns(len(active_habits) if len(active_habits) > 0 else 1)
     for i, habit in enumerate(active_habits):
-        streak = calculate_streak(df, habit)
+        streak = streaks.get(habit, 0)
         with cols[i % len(cols)]:
             st.metric(label=habit, value=f"{streak} Days", delta=get_badge(streak))
 
@@ -113,11 +219,7 @@ else:
     with tab1:
         sel_habit = st.selectbox("Select Habit", active_habits)
         if sel_habit:
-            create_heatmap_plotly(df, sel_habit)
+            create_heatmap_plotly(completed_by_habit.get(sel_habit, ()), sel_habit)
             
     with tab2:
-        mood_df = df[df['Mood'] != UNSELECTED_MOOD_KEY].copy()
-        if not mood_df.empty:
-            mood_df['Date'] = pd.to_datetime(mood_df['Date'])
-            fig_mood = px.line(mood_df, x='Date', y='Mood', title="Mood over Time", markers=True)
-            st.plotly_chart(fig_mood, use_container_width=True)
+        create_mood_chart(df)